@@ -3,12 +3,17 @@ Flask Web Dashboard for Vehicle Counting System
 Run this file to start the web server
 """
 
-from flask import Flask, render_template, Response, jsonify
+import cpu_threads  # Must be imported first - sets CPU thread limits
+from flask import Flask, render_template, Response
 import cv2
+import simplejpeg
+import orjson
 from vehicle_counter import VehicleCounter
+from camera_capture import CaptureThread
 import json
 import datetime
-from threading import Thread, Lock
+import functools
+from threading import Thread, Lock, Condition
 import time
 
 app = Flask(__name__)
@@ -16,20 +21,62 @@ app = Flask(__name__)
 # Global variables
 counter = None
 camera = None
-output_frame = None
-lock = Lock()
+capture = None         # CaptureThread reading from camera
+latest_jpeg = None     # Most recent encoded frame, shared by all viewers
+frame_seq = 0          # Bumped every time latest_jpeg is replaced
+frame_lock = Lock()    # Protects latest_jpeg / frame_seq
+frame_ready = Condition(frame_lock)
+stats_lock = Lock()    # Protects stats - taken by every writer and by get_stats' copy
 is_running = False
+PROCESS_WIDTH = 640    # Frames wider than this are downscaled before counting
 stats = {
     'total_count': 0,
     'hourly_rate': 0,
-    'session_start': None,
+    'session_start': None,     # time.time() floats, formatted in get_stats
     'last_detection': None,
     'status': 'Stopped'
 }
+stats_version = 0      # Bumped whenever stats change in a way the dashboard should see
+
+def bump_stats_version():
+    """Invalidate the cached /api/stats response"""
+    global stats_version
+    stats_version += 1
+
+def json_response(obj):
+    """Serialize obj with orjson into an application/json response"""
+    return Response(orjson.dumps(obj), mimetype='application/json')
+
+def ttl_cache(seconds, version=None):
+    """
+    Cache a JSON view's response body for a number of seconds
+    
+    Args:
+        seconds: How long a cached body stays valid
+        version: Optional callable; the cache is also dropped when its
+                 return value changes
+    """
+    def decorator(view):
+        cached = {}  # 'entry' -> (expires_at, version, body_bytes)
+        
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            now = time.monotonic()
+            current_version = version() if version else None
+            entry = cached.get('entry')
+            
+            if entry is None or entry[0] <= now or entry[1] != current_version:
+                body = view(*args, **kwargs).get_data()
+                entry = (now + seconds, current_version, body)
+                cached['entry'] = entry
+            
+            return Response(entry[2], mimetype='application/json')
+        return wrapper
+    return decorator
 
 def initialize_camera(camera_source=0):
     """Initialize the camera and start processing"""
-    global counter, camera, is_running, stats
+    global counter, camera, capture, is_running, stats
     
     print("Initializing camera...")
     counter = VehicleCounter(line_position=0.5)
@@ -39,72 +86,93 @@ def initialize_camera(camera_source=0):
         print("Error: Could not open camera")
         return False
     
+    # Don't let the driver queue up stale frames. Colour conversion
+    # (CAP_PROP_CONVERT_RGB) stays on - YOLO and the video feed both need BGR
+    camera.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+    
+    # Read the camera on its own thread so processing gets the newest frame
+    # (frames that arrive while processing is busy are never decoded)
+    capture = CaptureThread(camera).start()
+    
     is_running = True
-    stats['session_start'] = datetime.datetime.now().isoformat()
-    stats['status'] = 'Running'
+    with stats_lock:
+        stats['session_start'] = time.time()
+        stats['status'] = 'Running'
+    bump_stats_version()
     print("✓ Camera initialized successfully!")
     return True
 
 def process_camera():
     """Process camera frames continuously"""
-    global output_frame, camera, counter, is_running, stats
+    global latest_jpeg, frame_seq, capture, counter, is_running, stats
     
-    frame_count = 0
+    small_buffer = None  # Reused for every downscaled frame
+    last_count = None    # Count when the stats version was last bumped
     
     while is_running:
-        if camera is None or not camera.isOpened():
+        if capture is None:
             time.sleep(1)
             continue
         
-        ret, frame = camera.read()
+        # Newest frame from the capture thread. It isn't copied - the
+        # buffer stays ours until the next read()
+        ret, frame = capture.read()
         if not ret:
             print("Error reading frame")
             time.sleep(1)
             continue
         
-        frame_count += 1
+        # Downscale once - detection, drawing and JPEG encoding all
+        # scale with pixel count
+        height, width = frame.shape[:2]
+        if width > PROCESS_WIDTH:
+            size = (PROCESS_WIDTH, int(height * PROCESS_WIDTH / width))
+            small_buffer = cv2.resize(frame, size, dst=small_buffer,
+                                      interpolation=cv2.INTER_AREA)
+            frame = small_buffer
         
-        # Process every 2nd frame for performance
-        if frame_count % 2 == 0:
-            # Count vehicles
-            frame = counter.process_frame(frame)
-            
-            # Update stats
-            with lock:
-                stats['total_count'] = counter.total_count
-                stats['last_detection'] = datetime.datetime.now().isoformat()
-                
-                # Calculate hourly rate
-                if counter.session_start:
-                    elapsed_hours = (time.time() - counter.session_start) / 3600
-                    if elapsed_hours > 0:
-                        stats['hourly_rate'] = int(counter.total_count / elapsed_hours)
-            
-            # Update output frame
-            with lock:
-                output_frame = frame.copy()
+        # Count vehicles
+        frame = counter.process_frame(frame)
+        
+        # Update stats. total_count and hourly_rate are read straight from
+        # the counter by get_stats; just refresh its cache on a new count
+        if counter.total_count != last_count:
+            last_count = counter.total_count
+            bump_stats_version()
+        
+        with stats_lock:
+            stats['last_detection'] = time.time()
+        
+        # Encode once here so every viewer shares the same bytes
+        jpeg = simplejpeg.encode_jpeg(frame, quality=80, colorspace='BGR',
+                                      fastdct=True)
+        
+        # Publish and wake up any waiting streams
+        with frame_ready:
+            latest_jpeg = jpeg
+            frame_seq += 1
+            frame_ready.notify_all()
 
 def generate_frames():
     """Generate frames for video streaming"""
-    global output_frame, lock
+    last_seq = 0
     
     while True:
-        with lock:
-            if output_frame is None:
-                continue
-            
-            # Encode frame as JPEG
-            ret, buffer = cv2.imencode('.jpg', output_frame)
-            if not ret:
-                continue
-            
-            frame = buffer.tobytes()
+        # Block until the producer publishes a frame we haven't sent yet.
+        # On timeout the last frame is re-sent as a keepalive: a viewer that
+        # left while the camera was stopped is only noticed on a write, and
+        # the GeneratorExit then lands at the yield, outside the lock.
+        with frame_ready:
+            frame_ready.wait_for(lambda: frame_seq != last_seq, timeout=1.0)
+            frame = latest_jpeg
+            last_seq = frame_seq
+        
+        if frame is None:
+            continue
         
         # Yield frame in byte format
         yield (b'--frame\r\n'
                b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
-        
-        time.sleep(0.033)  # ~30 FPS
 
 @app.route('/')
 def index():
@@ -118,10 +186,26 @@ def video_feed():
                     mimetype='multipart/x-mixed-replace; boundary=frame')
 
 @app.route('/api/stats')
+@ttl_cache(seconds=5, version=lambda: stats_version)
 def get_stats():
     """Get current statistics"""
-    with lock:
-        return jsonify(stats)
+    with stats_lock:
+        current = dict(stats)
+    
+    # Timestamps are stored raw and only formatted here, per API call
+    for key in ('session_start', 'last_detection'):
+        if current[key] is not None:
+            current[key] = datetime.datetime.fromtimestamp(current[key]).isoformat()
+    
+    # Plain int reads from the counter - no lock needed
+    active_counter = counter
+    if active_counter is not None:
+        total_count = active_counter.total_count
+        elapsed_hours = (time.time() - active_counter.session_start) / 3600
+        current['total_count'] = total_count
+        current['hourly_rate'] = int(total_count / elapsed_hours) if elapsed_hours > 0 else 0
+    
+    return json_response(current)
 
 @app.route('/api/start/<int:camera_id>')
 def start_camera(camera_id):
@@ -129,29 +213,40 @@ def start_camera(camera_id):
     global is_running
     
     if is_running:
-        return jsonify({'status': 'error', 'message': 'Already running'})
+        return json_response({'status': 'error', 'message': 'Already running'})
     
     if initialize_camera(camera_id):
         # Start processing thread
         thread = Thread(target=process_camera, daemon=True)
         thread.start()
-        return jsonify({'status': 'success', 'message': 'Camera started'})
+        return json_response({'status': 'success', 'message': 'Camera started'})
     else:
-        return jsonify({'status': 'error', 'message': 'Could not start camera'})
+        return json_response({'status': 'error', 'message': 'Could not start camera'})
 
 @app.route('/api/stop')
 def stop_camera():
     """Stop the camera"""
-    global is_running, camera, stats
+    global is_running, camera, capture, stats
     
     is_running = False
-    stats['status'] = 'Stopped'
+    with stats_lock:
+        stats['status'] = 'Stopped'
+    bump_stats_version()
+    
+    # Stop reading before releasing the camera underneath the thread
+    if capture is not None:
+        capture.stop()
+        capture = None
     
     if camera is not None:
         camera.release()
         camera = None
     
-    return jsonify({'status': 'success', 'message': 'Camera stopped'})
+    # Write the session's queued vehicles and stop its flusher
+    if counter is not None:
+        counter.end_session()
+    
+    return json_response({'status': 'success', 'message': 'Camera stopped'})
 
 @app.route('/api/reset')
 def reset_counter():
@@ -159,39 +254,28 @@ def reset_counter():
     global counter, stats
     
     if counter is not None:
+        counter.end_session()
         counter = VehicleCounter(line_position=0.5)
-        stats['total_count'] = 0
-        stats['hourly_rate'] = 0
-        stats['session_start'] = datetime.datetime.now().isoformat()
+        with stats_lock:
+            stats['session_start'] = time.time()
+        bump_stats_version()
     
-    return jsonify({'status': 'success', 'message': 'Counter reset'})
+    return json_response({'status': 'success', 'message': 'Counter reset'})
 
 @app.route('/api/history')
+@ttl_cache(seconds=60)
 def get_history():
     """Get historical data from database"""
     try:
         from database import VehicleDatabase
         db = VehicleDatabase()
         
-        # Get last 7 days
-        data = db.get_last_n_days(7)
-        
-        history = []
-        for day in data:
-            date = day['date']
-            count = day['count']
-            
-            # Get peak hour for this date
-            peak = db.get_peak_hour(date)
-            
-            history.append({
-                'date': date,
-                'total': count,
-                'peak_hour': f"{peak['hour']:02d}:00" if peak else '00:00',
-                'peak_count': peak['count'] if peak else 0
-            })
+        # Get last 7 days (totals and peak hours in one query)
+        history = db.get_history(7)
+        for day in history:
+            day['peak_hour'] = f"{day['peak_hour']:02d}:00"
         
-        return jsonify(history)
+        return json_response(history)
         
     except Exception as e:
         print(f"Database error: {e}")
@@ -208,7 +292,7 @@ def get_history():
                 'peak_count': 0
             })
         
-        return jsonify(history)
+        return json_response(history)
 
 if __name__ == '__main__':
     print("="*60)
@@ -219,5 +303,6 @@ if __name__ == '__main__':
     print("\nPress Ctrl+C to stop the server")
     print("="*60 + "\n")
     
-    # Run Flask app
-    app.run(debug=True, host='0.0.0.0', port=5000, threaded=True)
\ No newline at end of file
+    # Run with a production WSGI server - each video viewer holds a thread
+    from waitress import serve
+    serve(app, host='0.0.0.0', port=5000, threads=16)
\ No newline at end of file
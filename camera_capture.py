@@ -0,0 +1,134 @@
+"""
+Background frame capture for the Vehicle Counting System
+Reads the camera on its own thread so processing always gets the newest frame
+"""
+
+from threading import Thread, Condition
+import time
+
+
+class CaptureThread:
+    """
+    Reads frames from an opened cv2.VideoCapture on a background thread
+    
+    Every frame is grabbed so the driver never queues stale frames, and
+    the newest one is decoded (retrieved) ahead of time whenever the
+    reader has already taken the previous decoded frame - so decoding
+    overlaps the reader's processing. If processing is slower than the
+    camera, the frames grabbed while a decoded frame is still unread are
+    dropped without ever being decoded.
+    
+    Frames rotate through three reused buffers: one being filled by the
+    camera, one holding the newest complete frame, and one handed out by
+    read(). A frame returned by read() stays valid until the next call.
+    
+    A failed grab/retrieve is retried after RETRY_DELAY seconds, so
+    brief webcam/USB hiccups don't stop capture; only MAX_FAILURES
+    failures in a row (e.g. the end of a video) end it.
+    """
+    
+    RETRY_DELAY = 0.1   # Seconds to wait after a failed read
+    MAX_FAILURES = 30   # Consecutive failures before giving up (~3 s)
+    
+    def __init__(self, cap, every=1):
+        """
+        Args:
+            cap: An opened cv2.VideoCapture
+            every: Only decode every Nth frame (e.g. 2 = skip every other)
+        """
+        self.cap = cap
+        self.every = every
+        self.running = False
+        
+        self._buffers = [None, None, None]
+        self._latest = None     # Buffer index of the newest complete frame
+        self._reading = None    # Buffer index currently handed out by read()
+        self._seq = 0           # Bumped for every new frame
+        self._last_read = 0     # Sequence number last returned by read()
+        self._ended = False     # Camera stopped delivering frames
+        self._cond = Condition()
+        self._thread = None
+    
+    def start(self):
+        """Start capturing in the background"""
+        self.running = True
+        self._thread = Thread(target=self._capture_loop, daemon=True)
+        self._thread.start()
+        return self
+    
+    def stop(self):
+        """Stop capturing and wait for the thread to exit"""
+        self.running = False
+        with self._cond:
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=2.0)
+            self._thread = None
+    
+    def _capture_loop(self):
+        """Background thread: keep the newest frame in a free buffer"""
+        grabbed = 0
+        failures = 0
+        
+        while self.running:
+            # Advance the stream without decoding
+            if not self.cap.grab():
+                failures += 1
+                if failures >= self.MAX_FAILURES:
+                    break
+                time.sleep(self.RETRY_DELAY)
+                continue
+            failures = 0
+            grabbed += 1
+            
+            with self._cond:
+                # Skipped frame, or a decoded frame is still waiting to be read
+                if grabbed % self.every != 0 or self._seq != self._last_read:
+                    continue
+                
+                # Fill a buffer that is neither the newest frame nor in use
+                idx = next(i for i in range(3)
+                           if i != self._latest and i != self._reading)
+            
+            ret, frame = self.cap.retrieve(self._buffers[idx])
+            if not ret:
+                failures += 1
+                if failures >= self.MAX_FAILURES:
+                    break
+                time.sleep(self.RETRY_DELAY)
+                continue
+            self._buffers[idx] = frame
+            
+            with self._cond:
+                self._latest = idx
+                self._seq += 1
+                self._cond.notify_all()
+        
+        with self._cond:
+            self._ended = True
+            self._cond.notify_all()
+    
+    def read(self, timeout=5.0):
+        """
+        Get the newest frame that hasn't been returned yet
+        
+        Blocks until one arrives, like cv2.VideoCapture.read()
+        
+        Args:
+            timeout: Seconds to wait for a new frame
+        
+        Returns:
+            (ret, frame) tuple; ret is False on timeout or when the
+            camera stops delivering frames
+        """
+        with self._cond:
+            self._cond.wait_for(
+                lambda: self._seq != self._last_read or self._ended or not self.running,
+                timeout=timeout
+            )
+            if self._seq == self._last_read:
+                return False, None
+            
+            self._reading = self._latest
+            self._last_read = self._seq
+            return True, self._buffers[self._reading]
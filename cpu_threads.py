@@ -0,0 +1,48 @@
+"""
+CPU thread limits for the Vehicle Counting System
+Import this before cv2/numpy/ultralytics so every library sizes its
+thread pool to the CPUs this process can actually use
+"""
+
+import os
+
+
+def available_cpus():
+    """
+    Number of CPUs this process may run on
+    
+    os.cpu_count() reports every core on the host, which is far too many
+    inside a container or under taskset. This also honours the CPU
+    affinity mask and a cgroup v2 CPU quota (Docker --cpus) when present.
+    
+    Returns:
+        CPU count, at least 1
+    """
+    count = os.cpu_count() or 1
+    
+    # CPU affinity (taskset, cpusets) - Linux only
+    if hasattr(os, 'sched_getaffinity'):
+        count = min(count, len(os.sched_getaffinity(0)))
+    
+    # CPU quota, e.g. "200000 100000" = 2 CPUs, "max 100000" = no limit
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            quota, period = f.read().split()
+        if quota != 'max':
+            count = min(count, int(quota) // int(period))
+    except (OSError, ValueError):
+        pass
+    
+    return max(1, count)
+
+
+NUM_THREADS = available_cpus()
+
+# BLAS/OpenMP pools (numpy, torch) read these once at import time.
+# setdefault so values set by the user still win
+for var in ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS'):
+    os.environ.setdefault(var, str(NUM_THREADS))
+
+import cv2  # After the environment is set
+
+cv2.setNumThreads(NUM_THREADS)
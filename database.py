@@ -6,6 +6,10 @@ Handles all data storage and retrieval
 import sqlite3
 import datetime
 import os
+import threading
+import time
+import collections
+import atexit
 from typing import List, Dict, Optional
 
 class VehicleDatabase:
@@ -13,6 +17,11 @@ class VehicleDatabase:
     Manages SQLite database for vehicle counting data
     """
     
+    # Vehicle entries are written in batches by a background thread
+    FLUSH_BATCH_SIZE = 500   # Max rows per transaction
+    FLUSH_INTERVAL = 1.0     # Seconds between flushes
+    ANALYZE_INTERVAL = 3600  # Seconds between planner statistics refreshes
+    
     def __init__(self, db_name='vehicles.db'):
         """
         Initialize database connection
@@ -21,18 +30,71 @@ class VehicleDatabase:
             db_name: Name of the database file
         """
         self.db_name = db_name
+        self._local = threading.local()
         self.init_database()
+        
+        # Pending vehicle entries, drained by the flusher thread.
+        # The thread is started on the first add_vehicle() so read-only
+        # instances (e.g. the dashboard's) don't spawn one.
+        self._pending = collections.deque()
+        self._flush_requested = threading.Event()
+        self._stop_flusher = threading.Event()
+        self._flusher = None
+        self._flusher_lock = threading.Lock()
+        # Held for a whole flush(), so a flush by end_session()/close()
+        # waits for one already running on the flusher thread
+        self._flush_lock = threading.Lock()
         print(f"✓ Database initialized: {db_name}")
     
     def get_connection(self):
-        """Get a database connection"""
-        return sqlite3.connect(self.db_name)
+        """
+        Get this thread's database connection
+        
+        Connections are opened once per thread and reused, since sqlite3
+        connections can't be shared across threads by default
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_name)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA temp_store=MEMORY')
+            # ANALYZE / PRAGMA optimize sample each index instead of reading all of it
+            conn.execute('PRAGMA analysis_limit=1000')
+            self._local.conn = conn
+        return conn
+    
+    def close(self):
+        """
+        Stop the flusher thread, write pending entries and close this
+        thread's database connection
+        
+        Also registered with atexit once entries have been queued, so
+        counted vehicles aren't lost when the program exits
+        """
+        atexit.unregister(self.close)
+        
+        if self._flusher is not None:
+            self._stop_flusher.set()
+            self._flush_requested.set()
+            self._flusher.join(timeout=5.0)
+            self._flusher = None
+        
+        self.flush()
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            # Refresh statistics for tables this connection queried
+            conn.execute('PRAGMA optimize')
+            conn.close()
+            self._local.conn = None
     
     def init_database(self):
         """Create tables if they don't exist"""
         conn = self.get_connection()
         cursor = conn.cursor()
         
+        # WAL lets the dashboard read while the counter is writing
+        cursor.execute('PRAGMA journal_mode=WAL')
+        
         # Table 1: Individual vehicle entries
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS vehicle_entries (
@@ -41,10 +103,28 @@ class VehicleDatabase:
                 lane TEXT,
                 vehicle_type TEXT,
                 confidence REAL,
-                session_id TEXT
+                session_id TEXT,
+                entry_date DATE GENERATED ALWAYS AS (date(timestamp)) STORED,
+                entry_hour INTEGER GENERATED ALWAYS AS (CAST(strftime('%H', timestamp) AS INTEGER)) STORED
             )
         ''')
         
+        # Databases created before entry_date/entry_hour existed.
+        # SQLite can only ALTER in VIRTUAL generated columns, which are
+        # still indexable.
+        cursor.execute('PRAGMA table_xinfo(vehicle_entries)')
+        columns = {row[1] for row in cursor.fetchall()}
+        if 'entry_date' not in columns:
+            cursor.execute('''
+                ALTER TABLE vehicle_entries ADD COLUMN entry_date DATE
+                GENERATED ALWAYS AS (date(timestamp)) VIRTUAL
+            ''')
+        if 'entry_hour' not in columns:
+            cursor.execute('''
+                ALTER TABLE vehicle_entries ADD COLUMN entry_hour INTEGER
+                GENERATED ALWAYS AS (CAST(strftime('%H', timestamp) AS INTEGER)) VIRTUAL
+            ''')
+        
         # Table 2: Daily summaries
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS daily_summary (
@@ -86,43 +166,135 @@ class VehicleDatabase:
             ON vehicle_entries(timestamp)
         ''')
         
+        # Superseded by idx_entry_date
+        cursor.execute('DROP INDEX IF EXISTS idx_date')
+        
         cursor.execute('''
-            CREATE INDEX IF NOT EXISTS idx_date 
-            ON vehicle_entries(date(timestamp))
+            CREATE INDEX IF NOT EXISTS idx_entry_date 
+            ON vehicle_entries(entry_date)
+        ''')
+        
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_entry_date_hour 
+            ON vehicle_entries(entry_date, entry_hour)
+        ''')
+        
+        # Covering indexes for the per-day lane / vehicle type breakdowns
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_date_lane 
+            ON vehicle_entries(entry_date, lane)
+        ''')
+        
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_date_vtype 
+            ON vehicle_entries(entry_date, vehicle_type)
         ''')
         
         conn.commit()
-        conn.close()
     
     # ==================== VEHICLE ENTRIES ====================
     
     def add_vehicle(self, lane='Lane 1', vehicle_type='Car', 
                    confidence=0.95, session_id=None):
         """
-        Add a vehicle entry to the database
+        Queue a vehicle entry for the database
+        
+        The entry is written by the background flusher within
+        FLUSH_INTERVAL seconds. Call flush() to write it immediately.
         
         Args:
             lane: Which lane the vehicle was in
             vehicle_type: Type of vehicle (Car, Truck, Bus, Motorcycle)
             confidence: Detection confidence score (0-1)
             session_id: Current session identifier
+        """
+        # Same format as CURRENT_TIMESTAMP, taken now rather than at flush time
+        timestamp = datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        self._pending.append((timestamp, lane, vehicle_type, confidence, session_id))
         
-        Returns:
-            The ID of the inserted record
+        if self._flusher is None:
+            with self._flusher_lock:
+                if self._flusher is None:
+                    self._stop_flusher.clear()
+                    self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+                    self._flusher.start()
+                    # Write whatever is still queued when the program exits
+                    atexit.register(self.close)
+        
+        if len(self._pending) >= self.FLUSH_BATCH_SIZE:
+            self._flush_requested.set()
+    
+    def flush(self):
         """
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        Write all queued vehicle entries to the database
         
-        cursor.execute('''
-            INSERT INTO vehicle_entries (lane, vehicle_type, confidence, session_id)
-            VALUES (?, ?, ?, ?)
-        ''', (lane, vehicle_type, confidence, session_id))
+        Returns:
+            Number of entries written
+            
+        If a batch fails it is rolled back and put back at the front of
+        the queue, and the error is raised
+        """
+        with self._flush_lock:
+            conn = self.get_connection()
+            cursor = conn.cursor()
+            written = 0
+            
+            while self._pending:
+                batch = []
+                while self._pending and len(batch) < self.FLUSH_BATCH_SIZE:
+                    batch.append(self._pending.popleft())
+                
+                try:
+                    cursor.execute('BEGIN IMMEDIATE')
+                    cursor.executemany('''
+                        INSERT INTO vehicle_entries (timestamp, lane, vehicle_type, confidence, session_id)
+                        VALUES (?, ?, ?, ?, ?)
+                    ''', batch)
+                    conn.commit()
+                except Exception:
+                    # Release the write lock and keep the entries for the next flush
+                    conn.rollback()
+                    self._pending.extendleft(reversed(batch))
+                    raise
+                written += len(batch)
+            
+            return written
+    
+    def update_statistics(self):
+        """
+        Re-sample the vehicle_entries indexes for the query planner
         
-        vehicle_id = cursor.lastrowid
+        Statistics taken while the table was small make the planner scan
+        the whole table instead of using the date indexes once it grows,
+        so they have to be refreshed as entries are added
+        """
+        conn = self.get_connection()
+        conn.execute('ANALYZE vehicle_entries')
         conn.commit()
-        conn.close()
-        
-        return vehicle_id
+    
+    def _flush_loop(self):
+        """
+        Background thread: flush queued entries every FLUSH_INTERVAL
+        and refresh planner statistics every ANALYZE_INTERVAL (starting
+        with the first pass) until close() is called
+        """
+        last_analyze = None
+        while not self._stop_flusher.is_set():
+            self._flush_requested.wait(self.FLUSH_INTERVAL)
+            self._flush_requested.clear()
+            try:
+                self.flush()
+                if last_analyze is None or time.monotonic() - last_analyze >= self.ANALYZE_INTERVAL:
+                    last_analyze = time.monotonic()
+                    self.update_statistics()
+            except Exception as e:
+                print(f"Database flush error: {e}")
+        
+        # This thread's connection isn't reachable from close()
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
     
     def get_recent_vehicles(self, limit=10):
         """
@@ -145,7 +317,6 @@ class VehicleDatabase:
         ''', (limit,))
         
         rows = cursor.fetchall()
-        conn.close()
         
         vehicles = []
         for row in rows:
@@ -174,11 +345,10 @@ class VehicleDatabase:
         today = datetime.date.today()
         cursor.execute('''
             SELECT COUNT(*) FROM vehicle_entries
-            WHERE DATE(timestamp) = ?
+            WHERE entry_date = ?
         ''', (today,))
         
         count = cursor.fetchone()[0]
-        conn.close()
         
         return count
     
@@ -197,11 +367,10 @@ class VehicleDatabase:
         
         cursor.execute('''
             SELECT COUNT(*) FROM vehicle_entries
-            WHERE DATE(timestamp) = ?
+            WHERE entry_date = ?
         ''', (str(date),))
         
         count = cursor.fetchone()[0]
-        conn.close()
         
         return count
     
@@ -210,34 +379,86 @@ class VehicleDatabase:
         Get vehicle counts for the last N days
         
         Args:
-            days: Number of days to retrieve
+            days: Number of days to retrieve (today included)
             
         Returns:
-            List of dictionaries with date and count
+            List of dictionaries with date and count, newest first, one
+            per day - days without vehicles have a count of 0
         """
         conn = self.get_connection()
         cursor = conn.cursor()
         
         cursor.execute('''
-            SELECT DATE(timestamp) as date, COUNT(*) as count
+            SELECT entry_date as date, COUNT(*) as count
             FROM vehicle_entries
-            WHERE DATE(timestamp) >= DATE('now', '-' || ? || ' days')
-            GROUP BY DATE(timestamp)
-            ORDER BY date DESC
-        ''', (days,))
+            WHERE entry_date >= DATE('now', printf('-%d days', ?))
+            GROUP BY entry_date
+        ''', (days - 1,))
         
-        rows = cursor.fetchall()
-        conn.close()
+        counts = dict(cursor.fetchall())
         
+        # Fill in days with no data. Timestamps are stored in UTC
+        today = datetime.datetime.now(datetime.timezone.utc).date()
         results = []
-        for row in rows:
+        for i in range(days):
+            date = (today - datetime.timedelta(days=i)).isoformat()
             results.append({
-                'date': row[0],
-                'count': row[1]
+                'date': date,
+                'count': counts.get(date, 0)
             })
         
         return results
     
+    def get_history(self, days=7):
+        """
+        Get daily totals and each day's peak hour for the last N days
+        
+        Args:
+            days: Number of days to retrieve (today included)
+            
+        Returns:
+            List of dictionaries with date, total, peak_hour and peak_count,
+            newest first, one per day - days without vehicles are all 0
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        # One pass: hourly counts per day, then rank hours within each day
+        cursor.execute('''
+            WITH hourly AS (
+                SELECT entry_date AS d, entry_hour AS h, COUNT(*) AS c
+                FROM vehicle_entries
+                WHERE entry_date >= DATE('now', printf('-%d days', ?))
+                GROUP BY d, h
+            ),
+            ranked AS (
+                SELECT d, h, c,
+                       ROW_NUMBER() OVER (PARTITION BY d ORDER BY c DESC, h) AS rn,
+                       SUM(c) OVER (PARTITION BY d) AS total
+                FROM hourly
+            )
+            SELECT d, total, h, c
+            FROM ranked
+            WHERE rn = 1
+        ''', (days - 1,))
+        
+        by_date = {row[0]: row for row in cursor.fetchall()}
+        
+        # Fill in days with no data. Timestamps are stored in UTC
+        today = datetime.datetime.now(datetime.timezone.utc).date()
+        history = []
+        for i in range(days):
+            date = (today - datetime.timedelta(days=i)).isoformat()
+            row = by_date.get(date, (date, 0, 0, 0))
+            history.append({
+                'date': date,
+                'total': row[1],
+                'peak_hour': row[2],
+                'peak_count': row[3]
+            })
+        
+        return history
+    
     # ==================== HOURLY STATISTICS ====================
     
     def get_hourly_stats(self, date=None):
@@ -258,17 +479,16 @@ class VehicleDatabase:
         
         cursor.execute('''
             SELECT 
-                CAST(strftime('%H', timestamp) AS INTEGER) as hour,
+                entry_hour as hour,
                 COUNT(*) as count,
                 AVG(confidence) as avg_confidence
             FROM vehicle_entries
-            WHERE DATE(timestamp) = ?
+            WHERE entry_date = ?
             GROUP BY hour
             ORDER BY hour
         ''', (str(date),))
         
         rows = cursor.fetchall()
-        conn.close()
         
         stats = []
         for row in rows:
@@ -298,17 +518,16 @@ class VehicleDatabase:
         
         cursor.execute('''
             SELECT 
-                CAST(strftime('%H', timestamp) AS INTEGER) as hour,
+                entry_hour as hour,
                 COUNT(*) as count
             FROM vehicle_entries
-            WHERE DATE(timestamp) = ?
+            WHERE entry_date = ?
             GROUP BY hour
             ORDER BY count DESC
             LIMIT 1
         ''', (str(date),))
         
         row = cursor.fetchone()
-        conn.close()
         
         if row:
             return {
@@ -338,13 +557,12 @@ class VehicleDatabase:
         cursor.execute('''
             SELECT lane, COUNT(*) as count
             FROM vehicle_entries
-            WHERE DATE(timestamp) = ?
+            WHERE entry_date = ?
             GROUP BY lane
             ORDER BY lane
         ''', (str(date),))
         
         rows = cursor.fetchall()
-        conn.close()
         
         stats = {}
         for row in rows:
@@ -373,13 +591,12 @@ class VehicleDatabase:
         cursor.execute('''
             SELECT vehicle_type, COUNT(*) as count
             FROM vehicle_entries
-            WHERE DATE(timestamp) = ?
+            WHERE entry_date = ?
             GROUP BY vehicle_type
             ORDER BY count DESC
         ''', (str(date),))
         
         rows = cursor.fetchall()
-        conn.close()
         
         breakdown = {}
         for row in rows:
@@ -405,7 +622,6 @@ class VehicleDatabase:
         ''', (session_id, datetime.datetime.now()))
         
         conn.commit()
-        conn.close()
     
     def end_session(self, session_id, total_vehicles):
         """
@@ -415,6 +631,9 @@ class VehicleDatabase:
             session_id: Session identifier
             total_vehicles: Final vehicle count
         """
+        # Make sure the session's last vehicles are on disk
+        self.flush()
+        
         conn = self.get_connection()
         cursor = conn.cursor()
         
@@ -425,7 +644,6 @@ class VehicleDatabase:
         ''', (datetime.datetime.now(), total_vehicles, session_id))
         
         conn.commit()
-        conn.close()
     
     # ==================== REPORTING ====================
     
@@ -482,31 +700,33 @@ class VehicleDatabase:
         conn = self.get_connection()
         cursor = conn.cursor()
         
-        query = 'SELECT * FROM vehicle_entries'
+        query = '''
+            SELECT id, timestamp, lane, vehicle_type, confidence, session_id
+            FROM vehicle_entries
+        '''
         params = []
         
         if start_date and end_date:
-            query += ' WHERE DATE(timestamp) BETWEEN ? AND ?'
+            query += ' WHERE entry_date BETWEEN ? AND ?'
             params = [str(start_date), str(end_date)]
         elif start_date:
-            query += ' WHERE DATE(timestamp) >= ?'
+            query += ' WHERE entry_date >= ?'
             params = [str(start_date)]
         
         query += ' ORDER BY timestamp'
         
         cursor.execute(query, params)
         
-        # Write to CSV
-        with open(filename, 'w', newline='') as csvfile:
+        # Write to CSV (large buffer - rows stream straight from the cursor)
+        with open(filename, 'w', newline='', buffering=1 << 20) as csvfile:
             csv_writer = csv.writer(csvfile)
             
             # Write header
             csv_writer.writerow(['ID', 'Timestamp', 'Lane', 'Vehicle Type', 'Confidence', 'Session ID'])
             
-            # Write data
-            csv_writer.writerows(cursor.fetchall())
+            # Write data without loading the whole result set into memory
+            csv_writer.writerows(cursor)
         
-        conn.close()
         print(f"✓ Data exported to {filename}")
     
     # ==================== UTILITY FUNCTIONS ====================
@@ -523,12 +743,11 @@ class VehicleDatabase:
         
         cursor.execute('''
             DELETE FROM vehicle_entries
-            WHERE DATE(timestamp) < DATE('now', '-' || ? || ' days')
+            WHERE entry_date < DATE('now', printf('-%d days', ?))
         ''', (days_to_keep,))
         
         deleted = cursor.rowcount
         conn.commit()
-        conn.close()
         
         print(f"✓ Deleted {deleted} old records")
         return deleted
@@ -548,14 +767,12 @@ class VehicleDatabase:
         total_entries = cursor.fetchone()[0]
         
         # Date range
-        cursor.execute('SELECT MIN(DATE(timestamp)), MAX(DATE(timestamp)) FROM vehicle_entries')
+        cursor.execute('SELECT MIN(entry_date), MAX(entry_date) FROM vehicle_entries')
         date_range = cursor.fetchone()
         
         # Database file size
         db_size = os.path.getsize(self.db_name) if os.path.exists(self.db_name) else 0
         
-        conn.close()
-        
         return {
             'total_entries': total_entries,
             'earliest_date': date_range[0],
@@ -587,6 +804,7 @@ if __name__ == "__main__":
             session_id=session_id
         )
     
+    db.flush()
     print(f"✓ Added 10 test vehicles")
     
     # Get today's count
@@ -0,0 +1,226 @@
+"""
+Frame display for the Vehicle Counting System test scripts
+Shows frames in an OpenGL window that is drawn on its own thread, so the
+processing loop never waits on the display
+"""
+
+import ctypes
+import queue
+import time
+from threading import Thread, Event
+
+import cv2
+
+# Optional: glfw + PyOpenGL for the threaded OpenGL viewer
+try:
+    import glfw
+    from OpenGL import GL
+except ImportError:
+    glfw = None
+
+# Texture coordinate (u, v) and window position (x, y) of each quad corner
+QUAD = [(0, 1, -1, -1), (1, 1, 1, -1), (1, 0, 1, 1), (0, 0, -1, 1)]
+
+
+class FrameDisplay:
+    """
+    Window that shows the newest frame handed to show()
+    
+    With glfw and PyOpenGL installed, frames are shown in an OpenGL window.
+    GLFW only allows window creation and event handling on the main
+    thread, so those stay on the caller's thread: the window is created by
+    the first show() and its events are handled in wait_key(). A
+    background thread owns only the OpenGL context. Frames reach it
+    through a 1-slot queue (a newer frame replaces one that hasn't been
+    drawn yet), are copied into a pixel buffer object and uploaded to a
+    persistent texture with glTexSubImage2D, so show() never blocks.
+    
+    Without them (or if no OpenGL window can be created) it falls back to
+    cv2.imshow / cv2.waitKey on the calling thread, exactly like before.
+    
+    Create the display and call show(), wait_key() and close() from the
+    main thread. Frames passed to show() must not be modified afterwards.
+    """
+    
+    def __init__(self, title):
+        """
+        Args:
+            title: Window title
+        """
+        self.title = title
+        self.use_gl = glfw is not None
+        
+        self._frames = queue.Queue(maxsize=1)
+        self._keys = queue.Queue()
+        self._closed = Event()
+        self._window = None
+        self._fb_size = (0, 0)
+        self._thread = None
+        
+        if self.use_gl and not glfw.init():
+            print("⚠ Could not initialize OpenGL - using cv2.imshow")
+            self.use_gl = False
+    
+    def show(self, frame):
+        """
+        Display a frame (BGR format)
+        
+        Args:
+            frame: OpenCV image to show
+        """
+        if self.use_gl and self._window is None:
+            self._open_window(frame)
+        
+        if not self.use_gl:
+            cv2.imshow(self.title, frame)
+            return
+        
+        # Replace a frame the render thread hasn't picked up yet
+        try:
+            self._frames.get_nowait()
+        except queue.Empty:
+            pass
+        self._frames.put(frame)
+    
+    def wait_key(self, delay=1):
+        """
+        Get the next key pressed in the window, like cv2.waitKey()
+        
+        Also handles the window's events, so it has to be called regularly.
+        
+        Args:
+            delay: Milliseconds to wait for a key press
+        
+        Returns:
+            Key code (e.g. ord('q')), or -1 if no key was pressed.
+            Closing the window counts as pressing 'q'.
+        """
+        if not self.use_gl:
+            return cv2.waitKey(delay) & 0xFF
+        
+        if self._window is None:
+            time.sleep(delay / 1000)
+            return -1
+        
+        deadline = time.monotonic() + delay / 1000
+        while True:
+            # Key and resize callbacks run here, on this thread
+            glfw.poll_events()
+            if glfw.window_should_close(self._window):
+                self._closed.set()
+            
+            if not self._keys.empty():
+                return self._keys.get_nowait()
+            if self._closed.is_set():
+                return ord('q')
+            
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return -1
+            glfw.wait_events_timeout(remaining)
+    
+    def close(self):
+        """Close the window"""
+        if not self.use_gl:
+            cv2.destroyAllWindows()
+            return
+        
+        self._closed.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2.0)
+            self._thread = None
+        if self._window is not None:
+            glfw.destroy_window(self._window)
+            self._window = None
+        glfw.terminate()
+    
+    def _open_window(self, frame):
+        """Create the window at the frame's size and start the render thread"""
+        height, width = frame.shape[:2]
+        window = glfw.create_window(width, height, self.title, None, None)
+        if not window:
+            print("⚠ Could not create OpenGL window - using cv2.imshow")
+            glfw.terminate()
+            self.use_gl = False
+            return
+        
+        glfw.set_key_callback(window, self._on_key)
+        glfw.set_framebuffer_size_callback(window, self._on_resize)
+        self._fb_size = glfw.get_framebuffer_size(window)
+        self._window = window
+        
+        self._thread = Thread(target=self._render_loop, args=(window, width, height),
+                              daemon=True)
+        self._thread.start()
+    
+    def _on_key(self, window, key, scancode, action, mods):
+        """glfw key callback: queue letter key presses as lowercase codes"""
+        if action == glfw.PRESS and 0 <= key < 128:
+            self._keys.put(ord(chr(key).lower()))
+    
+    def _on_resize(self, window, width, height):
+        """glfw framebuffer size callback: remember the size for drawing"""
+        self._fb_size = (width, height)
+    
+    def _render_loop(self, window, width, height):
+        """Background thread: own the OpenGL context and draw new frames"""
+        glfw.make_context_current(window)
+        glfw.swap_interval(0)  # Don't tie drawing to the monitor refresh
+        
+        # Texture allocated once; frames are streamed into it through a PBO
+        texture = GL.glGenTextures(1)
+        GL.glBindTexture(GL.GL_TEXTURE_2D, texture)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MIN_FILTER, GL.GL_LINEAR)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MAG_FILTER, GL.GL_LINEAR)
+        GL.glPixelStorei(GL.GL_UNPACK_ALIGNMENT, 1)
+        GL.glTexImage2D(GL.GL_TEXTURE_2D, 0, GL.GL_RGB8, width, height, 0,
+                        GL.GL_BGR, GL.GL_UNSIGNED_BYTE, None)
+        pbo = GL.glGenBuffers(1)
+        GL.glEnable(GL.GL_TEXTURE_2D)
+        
+        try:
+            frame = None
+            while not self._closed.is_set():
+                if frame is not None:
+                    if frame.shape[:2] == (height, width):
+                        self._upload(pbo, frame)
+                    frame = None
+                
+                # Full-window quad; texture row 0 is the top of the image
+                fb_width, fb_height = self._fb_size
+                GL.glViewport(0, 0, fb_width, fb_height)
+                GL.glBegin(GL.GL_QUADS)
+                for u, v, x, y in QUAD:
+                    GL.glTexCoord2f(u, v)
+                    GL.glVertex2f(x, y)
+                GL.glEnd()
+                glfw.swap_buffers(window)
+                
+                # Wait briefly for the next frame
+                try:
+                    frame = self._frames.get(timeout=0.01)
+                except queue.Empty:
+                    pass
+        finally:
+            # The main thread destroys the window once the context is released
+            self._closed.set()
+            GL.glDeleteBuffers(1, [pbo])
+            GL.glDeleteTextures([texture])
+            glfw.make_context_current(None)
+    
+    def _upload(self, pbo, frame):
+        """Copy a frame into the PBO and update the texture from it"""
+        frame = frame if frame.flags['C_CONTIGUOUS'] else frame.copy()
+        height, width = frame.shape[:2]
+        
+        GL.glBindBuffer(GL.GL_PIXEL_UNPACK_BUFFER, pbo)
+        # Orphan the old storage so the driver doesn't wait on the last upload
+        GL.glBufferData(GL.GL_PIXEL_UNPACK_BUFFER, frame.nbytes, None, GL.GL_STREAM_DRAW)
+        ptr = GL.glMapBuffer(GL.GL_PIXEL_UNPACK_BUFFER, GL.GL_WRITE_ONLY)
+        if ptr:
+            ctypes.memmove(ptr, frame.ctypes.data, frame.nbytes)
+            GL.glUnmapBuffer(GL.GL_PIXEL_UNPACK_BUFFER)
+            # Source offset 0 in the bound PBO
+            GL.glTexSubImage2D(GL.GL_TEXTURE_2D, 0, 0, 0, width, height,
+                               GL.GL_BGR, GL.GL_UNSIGNED_BYTE, ctypes.c_void_p(0))
+        GL.glBindBuffer(GL.GL_PIXEL_UNPACK_BUFFER, 0)
@@ -1,21 +1,32 @@
+import cpu_threads  # Must be imported first - sets CPU thread limits
 import cv2
+import numpy as np
 from vehicle_counter import VehicleCounter
+from camera_capture import CaptureThread
 import datetime
 import json
 import os
+import sys
 
 class LiveVehicleCounter:
     """
     Main application for live vehicle counting
     """
     
-    def __init__(self, camera_source=0, save_logs=True):
+    def __init__(self, camera_source=0, save_logs=True, headless=False):
         print("Initializing Live Vehicle Counter...")
         
         self.counter = VehicleCounter(line_position=0.5)
         self.camera_source = camera_source
         self.save_logs = save_logs
         
+        # Headless: no window and no on-screen text (e.g. on a server)
+        self.headless = headless
+        
+        # "LIVE" tag rendered once: (roi slices, sprite, mask)
+        self._live_tag = None
+        self._live_tag_shape = None
+        
         # Create logs folder if it doesn't exist
         if save_logs and not os.path.exists('logs'):
             os.makedirs('logs')
@@ -35,24 +46,40 @@ class LiveVehicleCounter:
                                             self.counter.session_start) / 60)
         }
         
-        # Log filename based on today's date
-        log_file = f"logs/count_{datetime.date.today()}.json"
-        
-        # Load existing logs or create new list
-        if os.path.exists(log_file):
-            with open(log_file, 'r') as f:
-                logs = json.load(f)
-        else:
-            logs = []
+        # Log filename based on today's date (JSON Lines - one entry per line)
+        log_file = f"logs/count_{datetime.date.today()}.jsonl"
         
-        logs.append(data)
-        
-        # Save updated logs
-        with open(log_file, 'w') as f:
-            json.dump(logs, f, indent=2)
+        # Append just this entry instead of rewriting the whole day's log
+        with open(log_file, 'a') as f:
+            f.write(json.dumps(data, separators=(',', ':')) + '\n')
         
         print(f"✓ Count saved to {log_file}")
     
+    def build_live_tag(self, frame):
+        """
+        Render the static "LIVE" tag once for this frame size
+        
+        Returns:
+            (roi, sprite, mask) - roi is a (rows, cols) slice pair into
+            the frame, sprite the rendered text, mask its drawn pixels
+        """
+        height, width = frame.shape[:2]
+        x, y = width - 80, 30
+        (text_width, text_height), baseline = cv2.getTextSize(
+            "LIVE", cv2.FONT_HERSHEY_SIMPLEX, 0.8, 2
+        )
+        
+        # Bounding box around the text, with room for the stroke width
+        top, bottom = max(y - text_height - 2, 0), min(y + baseline + 2, height)
+        left, right = max(x - 2, 0), min(x + text_width + 2, width)
+        
+        sprite = np.zeros((bottom - top, right - left, 3), dtype=np.uint8)
+        cv2.putText(sprite, "LIVE", (x - left, y - top),
+                   cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 255), 2)
+        mask = sprite.any(axis=2, keepdims=True)
+        
+        return (slice(top, bottom), slice(left, right)), sprite, mask
+    
     def run(self):
         """
         Run the live counting system
@@ -74,11 +101,21 @@ class LiveVehicleCounter:
             return
         
         print("✓ Camera connected successfully!")
-        print("\nControls:")
-        print("  'q' - Quit and save")
-        print("  's' - Save count now")
-        print("  'r' - Reset counter")
-        print("  'p' - Pause/Resume")
+        
+        # Don't let the driver queue up stale frames
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        
+        # Read the camera on its own thread so we always count the newest frame
+        capture = CaptureThread(cap).start()
+        
+        if self.headless:
+            print("\nRunning headless - press Ctrl+C to quit and save")
+        else:
+            print("\nControls:")
+            print("  'q' - Quit and save")
+            print("  's' - Save count now")
+            print("  'r' - Reset counter")
+            print("  'p' - Pause/Resume")
         print("\n" + "="*50 + "\n")
         
         paused = False
@@ -86,14 +123,18 @@ class LiveVehicleCounter:
         try:
             while True:
                 if not paused:
-                    ret, frame = cap.read()
+                    ret, frame = capture.read()
                     
                     if not ret:
                         print("✗ Error reading frame from camera")
                         break
                     
-                    # Process frame with counter
-                    frame = self.counter.process_frame(frame)
+                    # Process frame with counter (no annotations when headless)
+                    frame = self.counter.process_frame(frame, draw=not self.headless)
+                    
+                    # Nothing below is seen when running headless
+                    if self.headless:
+                        continue
                     
                     # Add timestamp
                     timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
@@ -101,10 +142,12 @@ class LiveVehicleCounter:
                                (10, frame.shape[0] - 20),
                                cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 1)
                     
-                    # Add status
-                    cv2.putText(frame, "LIVE", 
-                               (frame.shape[1] - 80, 30),
-                               cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 255), 2)
+                    # Add status (pre-rendered, just copied in)
+                    if self._live_tag_shape != frame.shape:
+                        self._live_tag = self.build_live_tag(frame)
+                        self._live_tag_shape = frame.shape
+                    roi, sprite, mask = self._live_tag
+                    np.copyto(frame[roi], sprite, where=mask)
                 
                 # Display frame
                 cv2.imshow('PortMiami Vehicle Counter - LIVE', frame)
@@ -119,6 +162,7 @@ class LiveVehicleCounter:
                     self.save_count_log()
                 elif key == ord('r'):
                     print("\nResetting counter...")
+                    self.counter.end_session()
                     self.counter = VehicleCounter(line_position=0.5)
                 elif key == ord('p'):
                     paused = not paused
@@ -129,11 +173,15 @@ class LiveVehicleCounter:
         
         finally:
             # Cleanup
+            capture.stop()
             cap.release()
-            cv2.destroyAllWindows()
+            if not self.headless:
+                # Not implemented in opencv-python-headless builds
+                cv2.destroyAllWindows()
             
             # Save final count
             self.save_count_log()
+            self.counter.end_session()
             
             print("\n" + "="*50)
             print("SESSION SUMMARY")
@@ -146,7 +194,8 @@ class LiveVehicleCounter:
 if __name__ == "__main__":
     # Configuration
     CAMERA_INDEX = 0  # Change this if your camera is on a different index
+    HEADLESS = '--headless' in sys.argv  # No window, e.g. on a server
     
     # Create and run the app
-    app = LiveVehicleCounter(camera_source=CAMERA_INDEX)
+    app = LiveVehicleCounter(camera_source=CAMERA_INDEX, headless=HEADLESS)
     app.run()
\ No newline at end of file
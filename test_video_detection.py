@@ -1,10 +1,106 @@
+import cpu_threads  # Must be imported first - sets CPU thread limits
 import cv2
 from vehicle_detector import VehicleDetector
+from frame_display import FrameDisplay
+from threading import Thread, Event
+import queue
+
+BATCH_SIZE = 4  # Frames sent to YOLO per forward pass
+QUEUE_SIZE = 4  # Frames buffered between pipeline stages
+
+def put_until_stopped(q, item, stop):
+    """Put item on the queue, giving up if the pipeline is stopped"""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+def run_stage(target, errors, *args):
+    """
+    Run a pipeline stage, recording any exception in errors so the
+    display loop can stop and re-raise it
+    """
+    try:
+        target(*args)
+    except Exception as e:
+        errors.append(e)
+
+def next_result(results, stages, errors):
+    """
+    Wait for the next (frame, detections) item from the detection stage
+    
+    Returns:
+        The item, or None when the video has ended or a stage has failed
+    """
+    while True:
+        try:
+            return results.get(timeout=0.1)
+        except queue.Empty:
+            if errors or not any(stage.is_alive() for stage in stages):
+                return None
+
+def read_frames(cap, frames, stop, progress):
+    """
+    Pipeline stage 1: decode every 3rd frame into the frames queue
+    The others are only grabbed and never decoded
+    """
+    while not stop.is_set():
+        if not cap.grab():
+            break
+        
+        progress['frame_count'] += 1
+        if progress['frame_count'] % 3 != 0:
+            continue
+        
+        ret, frame = cap.retrieve()
+        if not ret or not put_until_stopped(frames, frame, stop):
+            break
+    
+    # None marks the end of the video
+    put_until_stopped(frames, None, stop)
+
+def detect_frames(detector, frames, results, stop):
+    """
+    Pipeline stage 2: run YOLO on batches from the frames queue
+    """
+    ended = False
+    
+    while not ended and not stop.is_set():
+        try:
+            batch = [frames.get(timeout=0.1)]
+        except queue.Empty:
+            continue
+        
+        # Top the batch up with whatever has already been decoded
+        while batch[-1] is not None and len(batch) < BATCH_SIZE:
+            try:
+                batch.append(frames.get_nowait())
+            except queue.Empty:
+                break
+        
+        if batch[-1] is None:
+            ended = True
+            batch.pop()
+        
+        if batch:
+            # Detect vehicles in the whole batch with one forward pass
+            batch_detections = detector.detect_vehicles_batch(batch)
+            for frame, detections in zip(batch, batch_detections):
+                if not put_until_stopped(results, (frame, detections), stop):
+                    return
+    
+    put_until_stopped(results, None, stop)
 
 def test_video_detection(video_path):
     """
     Test vehicle detection on a video file
     Press 'q' to quit, 'p' to pause/unpause
+    
+    Decoding, detection and display run on separate threads connected by
+    small queues, so each frame's decode overlaps the previous detection
     """
     # Initialize detector
     print("Initializing detector...")
@@ -20,37 +116,49 @@ def test_video_detection(video_path):
     
     print("Processing video... Press 'q' to quit, 'p' to pause")
     
+    # Start the capture and detection stages
+    frames = queue.Queue(maxsize=QUEUE_SIZE)
+    results = queue.Queue(maxsize=QUEUE_SIZE)
+    stop = Event()
+    progress = {'frame_count': 0}
+    errors = []
+    
+    stages = [
+        Thread(target=run_stage, args=(read_frames, errors, cap, frames, stop, progress),
+               daemon=True),
+        Thread(target=run_stage, args=(detect_frames, errors, detector, frames, results, stop),
+               daemon=True)
+    ]
+    for stage in stages:
+        stage.start()
+    
     paused = False
-    frame_count = 0
+    display = FrameDisplay('Vehicle Detection Test')
     
+    # Stage 3 (this thread): draw and display
     while True:
         if not paused:
-            ret, frame = cap.read()
-            if not ret:
-                print("Video ended!")
+            item = next_result(results, stages, errors)
+            if item is None:
+                print("Pipeline stage failed!" if errors else "Video ended!")
                 break
             
-            frame_count += 1
+            frame, detections = item
             
-            # Process every 3rd frame for speed
-            if frame_count % 3 == 0:
-                # Detect vehicles
-                detections = detector.detect_vehicles(frame)
-                
-                # Draw detections
-                frame = detector.draw_detections(frame, detections)
-                
-                # Add info text
-                cv2.putText(frame, f"Vehicles Detected: {len(detections)}", 
-                           (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
-                cv2.putText(frame, "Press 'q' to quit, 'p' to pause", 
-                           (10, 70), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 1)
+            # Draw detections
+            frame = detector.draw_detections(frame, detections)
+            
+            # Add info text
+            cv2.putText(frame, f"Vehicles Detected: {len(detections)}",
+                       (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
+            cv2.putText(frame, "Press 'q' to quit, 'p' to pause",
+                       (10, 70), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 1)
         
-        # Display frame
-        cv2.imshow('Vehicle Detection Test', frame)
+            # Display frame (drawn on the display's own thread when using OpenGL)
+            display.show(frame)
         
-        # Handle keyboard input
-        key = cv2.waitKey(30) & 0xFF
+        # Handle keyboard input - only block for keys while paused
+        key = display.wait_key(30 if paused else 1)
         if key == ord('q'):
             print("Quitting...")
             break
@@ -58,10 +166,17 @@ def test_video_detection(video_path):
             paused = not paused
             print("Paused" if paused else "Resumed")
     
-    # Cleanup
+    # Cleanup - stop the stages before releasing the capture they use
+    stop.set()
+    for stage in stages:
+        stage.join()
     cap.release()
-    cv2.destroyAllWindows()
-    print(f"✓ Processed {frame_count} frames")
+    display.close()
+    print(f"✓ Processed {progress['frame_count']} frames")
+    
+    # Surface the failure the same way a single-threaded loop would
+    if errors:
+        raise errors[0]
 
 if __name__ == "__main__":
     # Test with your video file
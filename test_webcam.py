@@ -1,4 +1,6 @@
+import cpu_threads  # Must be imported first - sets CPU thread limits
 import cv2
+from frame_display import FrameDisplay
 
 def test_webcam():
     """
@@ -17,6 +19,8 @@ def test_webcam():
     print("✓ Camera connected!")
     print("Press 'q' to quit")
     
+    display = FrameDisplay('Webcam Test')
+    
     while True:
         ret, frame = cap.read()
         
@@ -28,13 +32,13 @@ def test_webcam():
         cv2.putText(frame, "Webcam Test - Press 'q' to quit", 
                    (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
         
-        cv2.imshow('Webcam Test', frame)
+        display.show(frame)
         
-        if cv2.waitKey(1) & 0xFF == ord('q'):
+        if display.wait_key(1) == ord('q'):
             break
     
     cap.release()
-    cv2.destroyAllWindows()
+    display.close()
     print("✓ Webcam test complete")
 
 if __name__ == "__main__":
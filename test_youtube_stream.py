@@ -1,25 +1,51 @@
+import cpu_threads  # Must be imported first - sets CPU thread limits
 import cv2
 from vehicle_counter import VehicleCounter
-import subprocess
-import json
+from camera_capture import CaptureThread
+import yt_dlp
+import re
 
 def get_youtube_stream_url(youtube_url):
     """
     Get the direct video stream URL from a YouTube video
+    
+    Uses yt-dlp as a library, so no subprocess is spawned
     """
     try:
-        cmd = [
-            'yt-dlp',
-            '-f', 'best',
-            '-g',  # Get direct URL
-            youtube_url
-        ]
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        return result.stdout.strip()
+        options = {'format': 'best', 'quiet': True}
+        with yt_dlp.YoutubeDL(options) as ydl:
+            info = ydl.extract_info(youtube_url, download=False)
+        return info['url']
     except Exception as e:
         print(f"Error getting stream URL: {e}")
         return None
 
+def open_stream(stream_url):
+    """
+    Open a stream URL with OpenCV
+    
+    If OpenCV was built with GStreamer, decode through a GStreamer
+    pipeline - decodebin picks a hardware decoder (NVDEC, VA-API, V4L2)
+    when one is installed. Otherwise use OpenCV's default FFmpeg backend.
+    
+    Args:
+        stream_url: Direct video/HLS URL
+        
+    Returns:
+        cv2.VideoCapture (check isOpened())
+    """
+    if re.search(r'GStreamer:\s*YES', cv2.getBuildInformation()):
+        pipeline = (
+            f'uridecodebin uri="{stream_url}" ! videoconvert ! '
+            'video/x-raw,format=BGR ! appsink drop=true max-buffers=1'
+        )
+        cap = cv2.VideoCapture(pipeline, cv2.CAP_GSTREAMER)
+        if cap.isOpened():
+            print("✓ Using GStreamer decode")
+            return cap
+    
+    return cv2.VideoCapture(stream_url)
+
 def test_youtube_traffic_cam(youtube_url):
     """
     Test with a YouTube live traffic camera
@@ -35,7 +61,7 @@ def test_youtube_traffic_cam(youtube_url):
     print("\nStarting vehicle counter...")
     
     counter = VehicleCounter(line_position=0.5)
-    cap = cv2.VideoCapture(stream_url)
+    cap = open_stream(stream_url)
     
     if not cap.isOpened():
         print("✗ Could not open stream")
@@ -44,27 +70,27 @@ def test_youtube_traffic_cam(youtube_url):
     print("✓ Stream opened!")
     print("\nPress 'q' to quit\n")
     
-    frame_count = 0
+    # Decode on a background thread so it overlaps detection; frames that
+    # arrive while detection is busy are never decoded
+    capture = CaptureThread(cap).start()
     
     while True:
-        ret, frame = cap.read()
+        ret, frame = capture.read()
         if not ret:
             print("Stream ended")
             break
         
-        frame_count += 1
-        
-        # Process every 2nd frame for better performance
-        if frame_count % 2 == 0:
-            frame = counter.process_frame(frame)
+        frame = counter.process_frame(frame)
         
         cv2.imshow('YouTube Traffic Stream', frame)
         
         if cv2.waitKey(1) & 0xFF == ord('q'):
             break
     
+    capture.stop()
     cap.release()
     cv2.destroyAllWindows()
+    counter.end_session()
     print(f"\nTotal vehicles counted: {counter.total_count}")
 
 if __name__ == "__main__":
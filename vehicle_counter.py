@@ -1,8 +1,48 @@
+import cpu_threads  # Must be imported first - sets CPU thread limits
 import cv2
+import numpy as np
 from vehicle_detector import VehicleDetector
 import time
 import datetime
 
+# Optional: numba compiles the matching loop to machine code
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+MAX_TRACKS = 256  # Most vehicles tracked near the line at once
+MAX_MISSED_FRAMES = 5  # Frames a track survives without a matching detection
+
+# Motion gate: frames are compared at this size, and detection is skipped
+# unless at least MOTION_MIN_PIXELS pixels changed by more than MOTION_DELTA
+MOTION_SIZE = (160, 90)
+MOTION_DELTA = 25
+MOTION_MIN_PIXELS = 20
+
+# Static stats panel labels: (text, origin, font scale, color, thickness);
+# the live values are drawn right after each one
+PANEL_LABELS = [
+    ("Total Count: ", (20, 45), 1.2, (0, 255, 0), 3),
+    ("Hourly Rate: ", (20, 80), 0.7, (255, 255, 255), 2),
+    ("Time: ", (20, 110), 0.6, (200, 200, 200), 1),
+]
+
+def _match(cx, cy, vids, coords, max_sq):
+    """
+    Return the ID of the first tracked vehicle within sqrt(max_sq) of
+    (cx, cy), or -1 if there is none
+    """
+    for i in range(vids.size):
+        dx = cx - coords[i, 0]
+        dy = cy - coords[i, 1]
+        if dx * dx + dy * dy < max_sq:
+            return vids[i]
+    return -1
+
+if njit is not None:
+    _match = njit(cache=True)(_match)
+
 class VehicleCounter:
     """
     Counts vehicles crossing a virtual line in the video
@@ -17,7 +57,29 @@ class VehicleCounter:
         
         # Tracking variables
         self.vehicle_centers = {}  # Track vehicle positions
-        self.counted_ids = set()   # IDs that have been counted
+        self.last_seen = {}        # Frame index each track was last matched
+        self.frame_index = 0       # Frames run through detection so far
+        self._next_id = 0          # Next vehicle ID - IDs are never reused
+        
+        # vehicle_centers as preallocated arrays for vectorized matching;
+        # only the first num_tracked rows are valid
+        self.tracked_ids = np.zeros(MAX_TRACKS, dtype=np.int32)
+        self.tracked_centers = np.zeros((MAX_TRACKS, 2), dtype=np.int32)
+        self.num_tracked = 0
+        
+        # Black panel blended under the stats text, allocated on the first frame
+        self._panel_black = None
+        self._panel_labels = None
+        
+        # Pre-rendered lane dividers, built for the first frame's size
+        self._lane_overlay = None
+        self._lane_mask = None
+        
+        # Motion gate state: previous small grayscale frame and the
+        # detections reused while the scene is static
+        self._prev_gray = None
+        self._last_detections = None
+        
         self.total_count = 0       # Total vehicles counted
         self.session_start = time.time()
         
@@ -41,26 +103,63 @@ class VehicleCounter:
                 print(f"⚠ Database error: {e} - running without database")
                 self.use_database = False
         
-    def get_center(self, bbox):
-        """Calculate center point of bounding box"""
-        x1, y1, x2, y2 = bbox
-        center_x = int((x1 + x2) / 2)
-        center_y = int((y1 + y2) / 2)
-        return (center_x, center_y)
+    def get_centers(self, bboxes):
+        """Calculate center points of an (N, 4) array of boxes -> (N, 2)"""
+        centers = np.empty((len(bboxes), 2), dtype=bboxes.dtype)
+        centers[:, 0] = (bboxes[:, 0] + bboxes[:, 2]) // 2
+        centers[:, 1] = (bboxes[:, 1] + bboxes[:, 3]) // 2
+        return centers
     
     def find_matching_vehicle(self, center, max_distance=50):
         """
         Find if this detection matches a previously tracked vehicle
         Returns vehicle ID if found, None if new vehicle
+        
+        Centers are integer pixels, so the check compares integer squared
+        distances against max_distance squared - no float math or sqrt
         """
-        cx, cy = center
+        if self.num_tracked == 0:
+            return None
         
-        for vid, (old_cx, old_cy) in self.vehicle_centers.items():
-            distance = ((cx - old_cx)**2 + (cy - old_cy)**2)**0.5
-            if distance < max_distance:
-                return vid
+        max_sq = max_distance * max_distance
         
-        return None
+        # Compiled early-exit loop when numba is installed
+        if njit is not None:
+            vid = _match(center[0], center[1], self.tracked_ids[:self.num_tracked],
+                         self.tracked_centers[:self.num_tracked], max_sq)
+            return None if vid < 0 else int(vid)
+        
+        # Otherwise squared distance to every tracked vehicle at once
+        diff = self.tracked_centers[:self.num_tracked] - np.asarray(center, dtype=np.int32)
+        dist_sq = np.einsum('ij,ij->i', diff, diff)
+        matches = np.flatnonzero(dist_sq < max_sq)
+        
+        if len(matches) == 0:
+            return None
+        return int(self.tracked_ids[matches[0]])
+    
+    def has_motion(self, frame):
+        """
+        Cheap check for whether anything moved since the previous frame
+        
+        Compares small grayscale copies of consecutive frames, so it costs
+        a tiny fraction of a YOLO pass
+        
+        Args:
+            frame: OpenCV image (BGR format)
+            
+        Returns:
+            True if enough pixels changed (always True for the first frame)
+        """
+        small = cv2.resize(frame, MOTION_SIZE, interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        prev_gray, self._prev_gray = self._prev_gray, gray
+        
+        if prev_gray is None:
+            return True
+        
+        diff = cv2.absdiff(gray, prev_gray)
+        return np.count_nonzero(diff > MOTION_DELTA) >= MOTION_MIN_PIXELS
     
     def determine_lane(self, center_x, frame_width):
         """
@@ -78,62 +177,92 @@ class VehicleCounter:
         lane_number = int(center_x / lane_width) + 1
         return f'Lane {lane_number}'
     
-    def process_frame(self, frame):
+    def process_frame(self, frame, draw=True):
         """
         Process frame and count vehicles crossing the line
+        
+        Annotations are drawn onto the given frame in place; the same
+        array is returned, so callers can reuse their frame buffers
+        
+        Args:
+            frame: OpenCV image (BGR format)
+            draw: Draw the line, lanes, boxes and stats panel; pass False
+                  when nobody will see the frame (e.g. headless runs)
         """
         height, width = frame.shape[:2]
         line_y = int(height * self.line_position)
         
+        # Nothing moved, so nothing can have crossed the line - skip
+        # detection and redraw the previous detections
+        if not self.has_motion(frame) and self._last_detections is not None:
+            if draw:
+                frame = self.draw_interface(frame, self._last_detections, line_y)
+            return frame
+        
         # Detect vehicles in this frame
         detections = self.detector.detect_vehicles(frame)
+        self._last_detections = detections
         
         # Update tracking
-        current_centers = {}
+        self.frame_index += 1
+        
+        # Only process vehicles near the counting line
+        centers = self.get_centers(detections.xyxy)
+        near_line = np.abs(centers[:, 1] - line_y) < 50
         
-        for det in detections:
-            center = self.get_center(det['bbox'])
-            cx, cy = center
+        for i in np.flatnonzero(near_line):
+            cx, cy = centers[i].tolist()
+            center = (cx, cy)
             
-            # Only process vehicles near the counting line
-            if abs(cy - line_y) < 50:
-                # Check if this is a known vehicle
-                vid = self.find_matching_vehicle(center)
+            # Check if this is a known vehicle
+            vid = self.find_matching_vehicle(center)
+            
+            if vid is None:
+                # New vehicle detected near line - give it a fresh ID and count it
+                vid = self._next_id
+                self._next_id += 1
+                self.total_count += 1
+                
+                # Determine lane and vehicle type
+                lane = self.determine_lane(cx, width)
+                class_name = self.detector.get_class_name(int(detections.cls[i]))
                 
-                if vid is None:
-                    # New vehicle detected near line
-                    vid = len(self.vehicle_centers) + len(current_centers)
-                    
-                    # Count it if not already counted
-                    if vid not in self.counted_ids:
-                        self.total_count += 1
-                        self.counted_ids.add(vid)
-                        
-                        # Determine lane
-                        lane = self.determine_lane(cx, width)
-                        
-                        # Save to database
-                        if self.use_database and self.db:
-                            try:
-                                self.db.add_vehicle(
-                                    lane=lane,
-                                    vehicle_type=det['class_name'],
-                                    confidence=det['confidence'],
-                                    session_id=self.session_id
-                                )
-                            except Exception as e:
-                                print(f"Database error: {e}")
-                        
-                        timestamp = time.strftime('%H:%M:%S')
-                        print(f"✓ Vehicle #{self.total_count} counted - {det['class_name']} in {lane} at {timestamp}")
+                # Queue for the database - VehicleDatabase writes queued entries
+                # in batched transactions on its own thread, so no disk I/O here
+                if self.use_database and self.db:
+                    try:
+                        self.db.add_vehicle(
+                            lane=lane,
+                            vehicle_type=class_name,
+                            confidence=float(detections.conf[i]),
+                            session_id=self.session_id
+                        )
+                    except Exception as e:
+                        print(f"Database error: {e}")
                 
-                current_centers[vid] = center
+                timestamp = time.strftime('%H:%M:%S')
+                print(f"✓ Vehicle #{self.total_count} counted - {class_name} in {lane} at {timestamp}")
+            
+            self.vehicle_centers[vid] = center
+            self.last_seen[vid] = self.frame_index
+        
+        # Forget vehicles that haven't been matched for a while, so the
+        # tracks stay bounded; a missed detection or two keeps the track
+        stale = [vid for vid, seen in self.last_seen.items()
+                 if self.frame_index - seen > MAX_MISSED_FRAMES]
+        for vid in stale:
+            del self.vehicle_centers[vid]
+            del self.last_seen[vid]
         
         # Update tracked vehicles
-        self.vehicle_centers = current_centers
+        self.num_tracked = min(len(self.vehicle_centers), MAX_TRACKS)
+        for slot, (vid, center) in zip(range(self.num_tracked), self.vehicle_centers.items()):
+            self.tracked_ids[slot] = vid
+            self.tracked_centers[slot] = center
         
         # Draw everything on frame
-        frame = self.draw_interface(frame, detections, line_y)
+        if draw:
+            frame = self.draw_interface(frame, detections, line_y)
         
         return frame
     
@@ -146,12 +275,10 @@ class VehicleCounter:
         cv2.putText(frame, "COUNTING LINE", (10, line_y - 10),
                    cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 255), 2)
         
-        # Draw lane dividers (dashed lines)
-        lane_width = width / 4
-        for i in range(1, 4):
-            x = int(lane_width * i)
-            for y in range(0, height, 20):
-                cv2.line(frame, (x, y), (x, y + 10), (100, 100, 100), 1)
+        # Draw lane dividers (dashed lines) - one masked copy per frame
+        if self._lane_overlay is None or self._lane_overlay.shape != frame.shape:
+            self.build_lane_overlay(frame)
+        np.copyto(frame, self._lane_overlay, where=self._lane_mask)
         
         # Draw vehicle detections (green boxes)
         frame = self.detector.draw_detections(frame, detections)
@@ -161,42 +288,103 @@ class VehicleCounter:
         
         return frame
     
+    def build_lane_overlay(self, frame):
+        """
+        Pre-render the dashed lane dividers for frames of this size
+        
+        Args:
+            frame: A frame with the size and layout of the video
+        """
+        height, width = frame.shape[:2]
+        self._lane_overlay = np.zeros_like(frame)
+        self._lane_mask = np.zeros((height, width, 1), dtype=bool)
+        
+        # 11px dashes every 20px, matching cv2.line((x, y), (x, y + 10))
+        dashes = (np.arange(height) % 20) <= 10
+        lane_width = width / 4
+        for i in range(1, 4):
+            x = int(lane_width * i)
+            self._lane_mask[:, x, 0] = dashes
+        self._lane_overlay[self._lane_mask[:, :, 0]] = (100, 100, 100)
+    
+    def build_panel_labels(self, panel_shape):
+        """
+        Render the static stats panel text once
+        
+        The label prefixes ("Total Count: " etc.) and the database status
+        never change, so they are drawn into a sprite covering the panel
+        and only the numbers are drawn per frame
+        
+        Args:
+            panel_shape: Shape of the panel ROI (top-left corner at 10, 10)
+            
+        Returns:
+            (sprite, alpha, inv_alpha, value_x) - the label colours, how
+            much of each pixel the text covers (float32, 0-1, so anti-aliased
+            text blends like putText), and the frame x where each prefix's
+            value starts
+        """
+        if self.use_database:
+            db_label = ("DB: Connected", (20, 135), 0.5, (0, 255, 0), 1)
+        else:
+            db_label = ("DB: Offline", (20, 135), 0.5, (255, 255, 0), 1)
+        
+        sprite = np.zeros(panel_shape, dtype=np.uint8)
+        coverage = np.zeros(panel_shape[:2], dtype=np.uint8)
+        value_x = []
+        for text, (x, y), scale, color, thickness in PANEL_LABELS + [db_label]:
+            label = np.zeros_like(coverage)
+            cv2.putText(label, text, (x - 10, y - 10),
+                       cv2.FONT_HERSHEY_SIMPLEX, scale, 255, thickness)
+            sprite[label > 0] = color
+            np.maximum(coverage, label, out=coverage)
+            
+            # Advance of the prefix, measured the way putText lays out the full string
+            with_digit = cv2.getTextSize(text + "0", cv2.FONT_HERSHEY_SIMPLEX, scale, thickness)[0][0]
+            digit = cv2.getTextSize("0", cv2.FONT_HERSHEY_SIMPLEX, scale, thickness)[0][0]
+            value_x.append(x + with_digit - digit)
+        
+        alpha = coverage.astype(np.float32) / 255
+        return sprite, alpha, 1 - alpha, value_x
+    
     def draw_stats_panel(self, frame):
         """Draw statistics overlay"""
         height, width = frame.shape[:2]
         
-        # Semi-transparent black panel
-        overlay = frame.copy()
-        cv2.rectangle(overlay, (10, 10), (400, 140), (0, 0, 0), -1)
-        cv2.addWeighted(overlay, 0.7, frame, 0.3, 0, frame)
+        # Semi-transparent black panel - only the panel area is blended,
+        # the ROI is a view so the result lands directly in frame
+        roi = frame[10:141, 10:401]
+        if self._panel_black is None or self._panel_black.shape != roi.shape:
+            self._panel_black = np.zeros_like(roi)
+            self._panel_labels = self.build_panel_labels(roi.shape)
+        cv2.addWeighted(self._panel_black, 0.7, roi, 0.3, 0, dst=roi)
+        
+        # Static labels and DB status from the pre-rendered sprite
+        sprite, alpha, inv_alpha, value_x = self._panel_labels
+        cv2.blendLinear(sprite, roi, alpha, inv_alpha, dst=roi)
         
         # Total count (large)
-        cv2.putText(frame, f"Total Count: {self.total_count}", 
-                   (20, 45), cv2.FONT_HERSHEY_SIMPLEX, 1.2, (0, 255, 0), 3)
+        cv2.putText(frame, str(self.total_count), 
+                   (value_x[0], 45), cv2.FONT_HERSHEY_SIMPLEX, 1.2, (0, 255, 0), 3)
         
         # Calculate hourly rate
         elapsed_hours = (time.time() - self.session_start) / 3600
         hourly_rate = int(self.total_count / elapsed_hours) if elapsed_hours > 0 else 0
         
-        cv2.putText(frame, f"Hourly Rate: {hourly_rate} vehicles/hr", 
-                   (20, 80), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
+        cv2.putText(frame, f"{hourly_rate} vehicles/hr", 
+                   (value_x[1], 80), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
         
         # Current time
         current_time = time.strftime("%H:%M:%S")
-        cv2.putText(frame, f"Time: {current_time}", 
-                   (20, 110), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (200, 200, 200), 1)
-        
-        # Database status
-        if self.use_database:
-            cv2.putText(frame, "DB: Connected", 
-                       (20, 135), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 1)
-        else:
-            cv2.putText(frame, "DB: Offline", 
-                       (20, 135), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 0), 1)
+        cv2.putText(frame, current_time, 
+                   (value_x[2], 110), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (200, 200, 200), 1)
     
     def end_session(self):
         """
         End the current session and save to database
+        
+        Writes any queued vehicle entries and stops the database's
+        background flusher; call once when done with this counter
         """
         if self.use_database and self.db and self.session_id:
             try:
@@ -204,6 +392,9 @@ class VehicleCounter:
                 print(f"✓ Session {self.session_id} ended - {self.total_count} vehicles counted")
             except Exception as e:
                 print(f"Error ending session: {e}")
+            finally:
+                self.db.close()
+                self.session_id = None
     
     def get_today_stats(self):
         """
@@ -1,6 +1,30 @@
+import cpu_threads  # Must be imported first - sets CPU thread limits
 import cv2
 from ultralytics import YOLO
 import numpy as np
+import os
+import sys
+from dataclasses import dataclass
+
+# TensorRT engine built from the .pt weights (see export_tensorrt_engine)
+ENGINE_PATH = 'yolov8n.engine'
+WEIGHTS_PATH = 'yolov8n.pt'
+
+# YOLO input size - larger frames are shrunk to this before inference
+INFERENCE_SIZE = 640
+
+@dataclass
+class Detections:
+    """
+    Vehicle detections for one frame, stored as parallel arrays
+    (row i of each array describes the same vehicle)
+    """
+    xyxy: np.ndarray   # (N, 4) int32 boxes: x1, y1, x2, y2
+    conf: np.ndarray   # (N,) float32 confidence scores
+    cls: np.ndarray    # (N,) int32 COCO class IDs
+    
+    def __len__(self):
+        return len(self.cls)
 
 class VehicleDetector:
     """
@@ -11,12 +35,22 @@ class VehicleDetector:
     def __init__(self):
         print("Loading AI model (this might take a minute first time)...")
         
-        # Load YOLO model - will auto-download on first run
-        self.model = YOLO('yolov8n.pt')
+        # Prefer the TensorRT engine if one has been exported for this
+        # machine, otherwise load YOLO model - will auto-download on first run
+        if os.path.exists(ENGINE_PATH):
+            self.model = YOLO(ENGINE_PATH, task='detect')
+            print("✓ Using TensorRT engine")
+        else:
+            self.model = YOLO(WEIGHTS_PATH)
         
         # Vehicle class IDs from COCO dataset:
         # 2 = car, 3 = motorcycle, 5 = bus, 7 = truck
         self.vehicle_classes = [2, 3, 5, 7]
+        self.confidence_threshold = 0.5  # Detection confidence (0-1)
+        
+        # Label sizes from cv2.getTextSize, keyed by label text - there are
+        # only 5 names x 100 confidence values, so this stays small
+        self._text_sizes = {}
         
         print("✓ Detector ready!")
     
@@ -28,35 +62,73 @@ class VehicleDetector:
             frame: OpenCV image (BGR format)
             
         Returns:
-            List of detections with bounding boxes and confidence
+            Detections with bounding boxes, confidences and class IDs
+        """
+        return self.detect_vehicles_batch([frame])[0]
+    
+    def detect_vehicles_batch(self, frames):
+        """
+        Detect vehicles in several frames with a single forward pass
+        
+        Args:
+            frames: List of OpenCV images (BGR format)
+            
+        Returns:
+            One Detections per frame, in the same order, with boxes in
+            the original frame's coordinates
         """
-        # Run YOLO detection on the frame
-        results = self.model(frame, verbose=False)
+        # Shrink large frames ourselves (INTER_AREA) so YOLO's preprocessing
+        # only touches INFERENCE_SIZE-sized images
+        small_frames = []
+        scales = []
+        for frame in frames:
+            height, width = frame.shape[:2]
+            scale = INFERENCE_SIZE / max(height, width)
+            if scale < 1.0:
+                frame = cv2.resize(frame, (int(width * scale), int(height * scale)),
+                                   interpolation=cv2.INTER_AREA)
+            else:
+                scale = 1.0
+            small_frames.append(frame)
+            scales.append(scale)
         
-        detections = []
+        # Frames go in as NumPy arrays on purpose: given a CUDA tensor,
+        # ultralytics copies the batch back to the host to build its results
+        # and syncs the GPU for an input range check.
+        # Run YOLO detection on all frames at once. The class and confidence
+        # filters are applied inside NMS, and stream=True yields results
+        # lazily instead of building and caching the whole list
+        results = self.model.predict(small_frames, imgsz=INFERENCE_SIZE, verbose=False, stream=True,
+                                     classes=self.vehicle_classes,
+                                     conf=self.confidence_threshold)
         
-        # Process each detection
-        for result in results:
-            boxes = result.boxes
+        return [self.extract_detections(result, scale)
+                for result, scale in zip(results, scales)]
+    
+    def extract_detections(self, result, scale=1.0):
+        """
+        Turn one YOLO result into vehicle Detections
+        
+        Args:
+            result: Ultralytics Results object for a single frame
+            scale: Factor the frame was resized by before detection;
+                   boxes are mapped back by 1/scale
             
-            for box in boxes:
-                # Get the class ID and confidence score
-                class_id = int(box.cls[0])
-                confidence = float(box.conf[0])
-                
-                # Only keep vehicles with good confidence
-                if class_id in self.vehicle_classes and confidence > 0.5:
-                    # Get bounding box coordinates
-                    x1, y1, x2, y2 = box.xyxy[0].cpu().numpy()
-                    
-                    detections.append({
-                        'bbox': (int(x1), int(y1), int(x2), int(y2)),
-                        'confidence': confidence,
-                        'class_id': class_id,
-                        'class_name': self.get_class_name(class_id)
-                    })
+        Returns:
+            Detections with bounding boxes, confidences and class IDs
+            (already vehicle-only - filtered by predict())
+        """
+        # One device->host copy per field for all boxes, rather than
+        # three tiny copies per box (a no-op when running on CPU)
+        boxes = result.boxes
+        class_ids = boxes.cls.cpu().numpy().astype(np.int32)
+        confidences = boxes.conf.cpu().numpy()
+        bboxes = boxes.xyxy.cpu().numpy()
+        if scale != 1.0:
+            bboxes = bboxes / scale
+        bboxes = bboxes.astype(np.int32)
         
-        return detections
+        return Detections(xyxy=bboxes, conf=confidences, cls=class_ids)
     
     def get_class_name(self, class_id):
         """Convert class ID to human-readable name"""
@@ -69,15 +141,15 @@ class VehicleDetector:
         
         Args:
             frame: OpenCV image
-            detections: List of detections from detect_vehicles()
+            detections: Detections from detect_vehicles()
             
         Returns:
             Frame with drawn boxes
         """
-        for det in detections:
-            x1, y1, x2, y2 = det['bbox']
-            conf = det['confidence']
-            name = det['class_name']
+        for (x1, y1, x2, y2), conf, class_id in zip(detections.xyxy.tolist(),
+                                                    detections.conf.tolist(),
+                                                    detections.cls.tolist()):
+            name = self.get_class_name(class_id)
             
             # Draw green rectangle around vehicle
             cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
@@ -85,10 +157,12 @@ class VehicleDetector:
             # Create label with vehicle type and confidence
             label = f"{name} {conf:.2f}"
             
-            # Draw black background for text
-            (text_width, text_height), _ = cv2.getTextSize(
-                label, cv2.FONT_HERSHEY_SIMPLEX, 0.6, 2
-            )
+            # Draw black background for text (label size measured once)
+            text_size = self._text_sizes.get(label)
+            if text_size is None:
+                text_size = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.6, 2)[0]
+                self._text_sizes[label] = text_size
+            text_width, text_height = text_size
             cv2.rectangle(frame, (x1, y1 - text_height - 10), 
                          (x1 + text_width, y1), (0, 255, 0), -1)
             
@@ -98,8 +172,32 @@ class VehicleDetector:
         
         return frame
 
+def export_tensorrt_engine(int8=False, max_batch=8):
+    """
+    Export the YOLO weights to a TensorRT engine (needs an NVIDIA GPU)
+    
+    Engines are specific to the GPU and TensorRT version they were built
+    on, so run this once on the deployment machine.
+    
+    Args:
+        int8: Use INT8 calibration instead of FP16 (slower to build)
+        max_batch: Largest batch size the engine will accept
+    """
+    model = YOLO(WEIGHTS_PATH)
+    options = {'format': 'engine', 'imgsz': 640, 'dynamic': True, 'batch': max_batch}
+    if int8:
+        options.update(int8=True, data='coco.yaml')
+    else:
+        options['half'] = True
+    
+    path = model.export(**options)
+    print(f"✓ TensorRT engine exported to {path}")
+
 # Test the detector
 if __name__ == "__main__":
+    if '--export-engine' in sys.argv:
+        export_tensorrt_engine(int8='--int8' in sys.argv)
+    
     print("Testing Vehicle Detector...")
     detector = VehicleDetector()
     print("✓ Detector initialized successfully!")